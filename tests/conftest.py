@@ -0,0 +1,29 @@
+import django
+from django.conf import settings
+
+
+def pytest_configure(config):
+    settings.configure(
+        SECRET_KEY="tests",
+        INSTALLED_APPS=[
+            "wagtail.documents",
+            "wagtail.search",
+            "wagtail",
+            "taggit",
+            "modelcluster",
+            "django.contrib.auth",
+            "django.contrib.contenttypes",
+        ],
+        DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+        USE_TZ=True,
+        STATIC_URL="/static/",
+        WAGTAILSEARCH_BACKENDS={
+            "default": {
+                "BACKEND": "wagtail_meilisearch.backend",
+                "HOST": "http://127.0.0.1",
+                "PORT": "7700",
+                "MASTER_KEY": "",
+            },
+        },
+    )
+    django.setup()
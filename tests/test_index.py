@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+from django.test import override_settings
+from wagtail.models import Page
+
+from wagtail_meilisearch.index import MeiliSearchModelIndex
+from wagtail_meilisearch.utils import to_ndjson
+
+
+class FakeClient:
+    def index(self, uid):
+        return SimpleNamespace(uid=uid)
+
+
+def get_index(model=Page, **backend_params):
+    backend = SimpleNamespace(
+        client=FakeClient(),
+        update_strategy="delta",
+        update_delta={"weeks": -1},
+        **backend_params,
+    )
+    return MeiliSearchModelIndex(backend, model)
+
+
+@override_settings(USE_TZ=False)
+def test_filter_deltas_without_time_zone_support():
+    index = get_index()
+    queryset = index.filter_deltas(Page.objects.all())
+
+    # SQLite rejects an aware cutoff when the query is compiled
+    sql, params = queryset.query.sql_with_params()
+    assert len(params) == len(index._date_fields)
+
+
+def test_batches_stay_under_the_byte_limit():
+    items = [{"id": pk, "title": "x" * size} for pk, size in enumerate([30, 30, 30, 300, 30])]
+    # Room for two of the small documents
+    max_chunk_bytes = len(to_ndjson(items[:2]))
+    index = get_index(bulk_chunk_size=100, bulk_max_chunk_bytes=max_chunk_bytes)
+    index.update_strategy = "hard"
+    index._create_document = lambda model, item: item
+
+    batches = list(index._iter_batches(items))
+
+    # The oversized document is sent on its own
+    assert batches == [
+        to_ndjson(items[:2]),
+        to_ndjson(items[2:3]),
+        to_ndjson(items[3:4]),
+        to_ndjson(items[4:]),
+    ]
@@ -0,0 +1,47 @@
+from concurrent.futures import Future
+from unittest.mock import MagicMock
+
+from wagtail.models import Page
+
+from wagtail_meilisearch.index import MeiliSearchModelIndex
+from wagtail_meilisearch.rebuilder import MeiliSearchRebuilder
+
+
+def get_rebuilder():
+    backend = MagicMock(update_strategy="hard", update_delta={"weeks": -1}, skip_models=[])
+    rebuilder = MeiliSearchRebuilder(MeiliSearchModelIndex(backend, Page))
+    rebuilder._start_rebuild_index()
+    return rebuilder, backend.client
+
+
+def sent_batch(error=None):
+    future = Future()
+    if error is None:
+        future.set_result({"taskUid": 1})
+    else:
+        future.set_exception(error)
+    return future
+
+
+def test_finish_swaps_in_the_rebuilt_index():
+    rebuilder, client = get_rebuilder()
+    rebuilder.rebuild_index._pending.append(sent_batch())
+
+    rebuilder.finish()
+
+    client.swap_indexes.assert_called_once_with(
+        [{"indexes": ["wagtailcore-Page", "wagtailcore-Page__rebuild"]}]
+    )
+
+
+def test_finish_keeps_the_live_index_when_a_batch_fails():
+    rebuilder, client = get_rebuilder()
+    rebuilder.rebuild_index._pending.append(sent_batch())
+    rebuilder.rebuild_index._pending.append(sent_batch(ConnectionError("refused")))
+    client.delete_index.reset_mock()
+
+    rebuilder.finish()
+
+    client.swap_indexes.assert_not_called()
+    client.delete_index.assert_called_once_with("wagtailcore-Page__rebuild")
+    assert rebuilder.rebuild_index is None
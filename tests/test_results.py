@@ -0,0 +1,158 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from meilisearch.errors import MeilisearchApiError
+from wagtail.documents.models import Document
+from wagtail.models import Page
+from wagtail.search.query import PlainText
+
+from wagtail_meilisearch import results as results_module
+from wagtail_meilisearch.results import MeiliSearchResults
+
+
+class FakeClient:
+    """
+    Returns hits 1 to 20 in MeiliSearch's order, with the later hits matching
+    more text, so scoring the match positions reverses the order.
+    """
+
+    def __init__(self, error=None):
+        self.queries = []
+        self.error = error
+
+    def multi_search(self, queries):
+        self.queries.extend(queries)
+        if self.error is not None and "showRankingScore" in queries[0]:
+            raise self.error
+        out = []
+        for query in queries:
+            hits = [
+                {
+                    "id": pk,
+                    "_rankingScore": 1 - pk / 100,
+                    "_matchesPosition": {"title": [{"start": 0, "length": pk}]},
+                }
+                for pk in range(1, 21)
+            ]
+            out.append({"indexUid": query["indexUid"], "hits": hits[: query["limit"]]})
+        return {"results": out}
+
+
+class FakeBackend:
+    def __init__(self, search_cache_ttl=0, error=None):
+        self.client = FakeClient(error)
+        self.query_limit = 1000
+        self.search_cache_ttl = search_cache_ttl
+        self.search_params = {}
+        self.server_key = ("http://127.0.0.1", "7700", "")
+        self._cache = {}
+        self.active_indexes = {"wagtailcore-Page"}
+
+    def get_active_indexes(self):
+        return self.active_indexes
+
+    def clear_active_indexes(self):
+        self.active_indexes = {"wagtailcore-Page"}
+
+    def get_cached_search(self, key):
+        return self._cache.get(key)
+
+    def cache_search(self, key, ids):
+        self._cache[key] = ids
+
+
+def get_results(backend, boosts, start=0, stop=3):
+    query_compiler = SimpleNamespace(
+        queryset=Page.objects.all(),
+        query=PlainText("page"),
+        order_by_relevance=True,
+    )
+    results = MeiliSearchResults(backend, query_compiler)
+    results.models = (Page,)
+    results._get_field_boosts = lambda model: boosts
+    results._set_limits(start, stop)
+    return results
+
+
+@pytest.mark.parametrize("search_cache_ttl", [0, 60])
+def test_boosted_order_is_the_same_with_and_without_the_cache(search_cache_ttl):
+    backend = FakeBackend(search_cache_ttl)
+    results = get_results(backend, {"title": 2})
+
+    assert results._get_sorted_ids()[:3] == [20, 19, 18]
+    assert backend.client.queries[0]["limit"] == 1000
+
+
+def test_ranking_score_order_only_asks_for_the_page():
+    backend = FakeBackend()
+    results = get_results(backend, {"title": 1})
+
+    assert results._get_sorted_ids() == [1, 2, 3]
+    assert backend.client.queries[0]["limit"] == 3
+    assert backend.client.queries[0]["showRankingScore"] is True
+
+
+def api_error(code, message, status_code=400):
+    response = SimpleNamespace(
+        status_code=status_code,
+        text=json.dumps({"code": code, "message": message}),
+    )
+    return MeilisearchApiError(message, response)
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        api_error("invalid_search_show_ranking_score", "Invalid value type"),
+        api_error("bad_request", "Unknown field `showRankingScore`"),
+    ],
+)
+def test_falls_back_to_match_scoring_when_ranking_scores_are_rejected(error):
+    backend = FakeBackend(error=error)
+    results = get_results(backend, {"title": 1})
+
+    assert results._get_sorted_ids()[:3] == [20, 19, 18]
+    assert "showRankingScore" not in backend.client.queries[-1]
+    assert backend.client.queries[-1]["limit"] == 1000
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        api_error("invalid_search_q", "Invalid value type"),
+        api_error("bad_request", "Unknown field `filter`"),
+        api_error("index_not_found", "Index not found", status_code=404),
+    ],
+)
+def test_other_search_errors_are_raised(error):
+    backend = FakeBackend(error=error)
+    results = get_results(backend, {"title": 1})
+
+    with pytest.raises(MeilisearchApiError):
+        results._get_sorted_ids()
+    assert backend.server_key not in results_module._servers_without_ranking_score
+
+
+def test_searches_again_when_a_cached_active_index_is_gone():
+    backend = FakeBackend()
+    backend.active_indexes = {"wagtailcore-Page", "wagtaildocs-Document"}
+    multi_search = backend.client.multi_search
+
+    def stale_multi_search(queries):
+        if any(query["indexUid"] == "wagtaildocs-Document" for query in queries):
+            raise api_error("index_not_found", "Index not found", status_code=404)
+        return multi_search(queries)
+
+    backend.client.multi_search = stale_multi_search
+    results = get_results(backend, {"title": 1})
+    results.models = (Page, Document)
+
+    assert results._get_sorted_ids() == [1, 2, 3]
+    assert backend.active_indexes == {"wagtailcore-Page"}
+
+
+@pytest.fixture(autouse=True)
+def clear_servers_without_ranking_score():
+    yield
+    results_module._servers_without_ranking_score.clear()
@@ -0,0 +1,28 @@
+from wagtail.documents.models import Document
+from wagtail.search.index import RelatedFields, SearchField
+
+from wagtail_meilisearch.utils import get_document_fields, get_resolved_search_fields
+
+
+class Book:
+    @classmethod
+    def get_search_fields(cls):
+        return [
+            RelatedFields("author", [SearchField("name"), RelatedFields("publisher", [])]),
+        ]
+
+
+def test_nested_related_fields_are_skipped():
+    ((field, name, sub_fields),) = get_resolved_search_fields(Book)
+
+    assert [sub_name for sub_field, sub_name in sub_fields] == ["author__name"]
+
+
+def test_related_fields_that_cant_be_loaded_are_skipped():
+    # An unsaved document's tags can't be queried
+    document = Document(title="Guide", collection_id=1)
+
+    fields = get_document_fields(Document, document)
+
+    assert fields["title"] == "Guide"
+    assert "tags__name" not in fields
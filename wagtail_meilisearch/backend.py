@@ -1,14 +1,26 @@
-import meilisearch
+import contextlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
 from django.db.models import QuerySet
-from django.utils.functional import cached_property
 from wagtail.search.backends.base import BaseSearchBackend, EmptySearchResults
 
+from .client import get_client
 from .index import MeiliSearchModelIndex
 from .query import MeiliSearchAutocompleteQueryCompiler, MeiliSearchQueryCompiler
 from .rebuilder import MeiliSearchRebuilder
 from .results import MeiliSearchResults
 from .settings import STOP_WORDS
-from .utils import class_is_indexed, get_indexed_models, weak_lru
+from .utils import class_is_indexed, get_index_label, get_indexed_models
+
+# Wagtail creates a new backend for every search, and for every object saved or
+# deleted, so anything worth keeping between requests is held here, keyed by the
+# backend's server.
+_active_indexes = {}
+_search_caches = {}
+_search_caches_lock = threading.Lock()
 
 
 class MeiliSearchBackend(BaseSearchBackend):
@@ -36,17 +48,32 @@ class MeiliSearchBackend(BaseSearchBackend):
         self.stop_words = params.get("STOP_WORDS", STOP_WORDS)
         self.skip_models = params.get("SKIP_MODELS", [])
         self.update_strategy = params.get("UPDATE_STRATEGY", "soft")
-        self.query_limit = params.get("QUERY_LIMIT", 999999)
+        self.query_limit = params.get("QUERY_LIMIT", 1000)
+        self.bulk_workers = params.get("BULK_WORKERS", 4)
+        self.bulk_retries = params.get("BULK_RETRIES", 3)
+        self.bulk_retry_delay = params.get("BULK_RETRY_DELAY", 1)
+        self.bulk_chunk_size = params.get("BULK_CHUNK_SIZE", 1000)
+        self.bulk_max_chunk_bytes = params.get("BULK_MAX_CHUNK_BYTES", 10 * 1024 * 1024)
+        self.active_indexes_ttl = params.get("ACTIVE_INDEXES_TTL", 60)
+        self.delta_rebuild_ratio = params.get("DELTA_REBUILD_RATIO", 0.1)
+        self.search_cache_ttl = params.get("SEARCH_CACHE_TTL", 0)
+        self.search_cache_size = params.get("SEARCH_CACHE_SIZE", 512)
+        self.index_registry = {}
+        self.server_key = self._init_server_key()
         self.search_params = self._init_search_params()
         self.update_delta = self._init_update_delta()
 
-    @cached_property
+    @property
     def client(self):
         """
         Lazily initialize and return the MeiliSearch client.
 
+        Nothing is created until the client is first used, so Django can start
+        up and run unrelated management commands without touching MeiliSearch.
+        Backends for the same server share a client, and its connections.
+
         Returns:
-            meilisearch.Client: The initialized MeiliSearch client.
+            MeiliSearchClient: The initialized MeiliSearch client.
         """
         if self._client is None:
             self._client = self._init_client()
@@ -57,20 +84,30 @@ class MeiliSearchBackend(BaseSearchBackend):
         Initialize the MeiliSearch client.
 
         Returns:
-            meilisearch.Client: The initialized MeiliSearch client.
+            MeiliSearchClient: The initialized MeiliSearch client.
 
         Raises:
             Exception: If the client initialization fails.
         """
         try:
-            return meilisearch.Client(
+            return get_client(
                 "{}:{}".format(self.params["HOST"], self.params["PORT"]),
                 self.params["MASTER_KEY"],
+                pool_size=self.params.get("HTTP_POOL_SIZE", max(10, self.bulk_workers)),
             )
         except Exception as err:
             msg = f"Failed to initialize MeiliSearch client: {err}"
             raise Exception(msg) from err
 
+    def _init_server_key(self):
+        """
+        Initialize the key the backend's shared state is kept under.
+
+        Returns:
+            tuple: The host, port and key of the MeiliSearch server.
+        """
+        return (self.params.get("HOST"), self.params.get("PORT"), self.params.get("MASTER_KEY"))
+
     def _init_search_params(self):
         """
         Initialize the search parameters.
@@ -81,7 +118,6 @@ class MeiliSearchBackend(BaseSearchBackend):
         return {
             "limit": self.query_limit,
             "attributesToRetrieve": ["id"],
-            "showMatchesPosition": True,
         }
 
     def _init_update_delta(self):
@@ -95,18 +131,151 @@ class MeiliSearchBackend(BaseSearchBackend):
             return self.params.get("UPDATE_DELTA", {"weeks": -1})
         return None
 
-    @weak_lru()
+    def get_active_indexes(self):
+        """
+        Get the uids of the indexes that currently exist in MeiliSearch.
+
+        MeiliSearch only creates an index once it has documents, and multi_search
+        fails outright if any of its queries targets a missing index. The list is
+        cached for ACTIVE_INDEXES_TTL seconds, shared by every backend in the
+        process for the same server, so that searches don't pay for an extra
+        round trip every time.
+
+        Returns:
+            set: The uids of the active indexes.
+        """
+        now = time.monotonic()
+        cached = _active_indexes.get(self.server_key)
+        if cached is not None and now - cached[0] <= self.active_indexes_ttl:
+            return cached[1]
+
+        # Page through the indexes, so none are missed however many there are
+        uids = set()
+        offset = 0
+        while True:
+            result = self.client.get_indexes({"offset": offset, "limit": 1000})
+            uids.update(index.uid for index in result["results"])
+            offset += len(result["results"])
+            if not result["results"] or offset >= result.get("total", offset):
+                break
+
+        _active_indexes[self.server_key] = (now, uids)
+        return uids
+
+    def clear_active_indexes(self, label=None):
+        """
+        Drop the cached list of active indexes.
+
+        Args:
+            label (str, optional): Only clear the cache if this index isn't in it yet.
+        """
+        cached = _active_indexes.get(self.server_key)
+        if label is not None and cached is not None and label in cached[1]:
+            return
+        _active_indexes.pop(self.server_key, None)
+
+    def get_cached_search(self, key):
+        """
+        Get the ids a recent search returned, if it's still in the search cache.
+
+        Args:
+            key (tuple): The search's cache key.
+
+        Returns:
+            list or None: The ids, or None if the search isn't cached or has expired.
+        """
+        with _search_caches_lock:
+            search_cache = _search_caches.get(self.server_key)
+            entry = search_cache.get(key) if search_cache is not None else None
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.search_cache_ttl:
+                del search_cache[key]
+                return None
+            search_cache.move_to_end(key)
+            return entry[1]
+
+    def cache_search(self, key, ids):
+        """
+        Keep the ids a search returned for SEARCH_CACHE_TTL seconds, dropping the
+        least recently used searches past SEARCH_CACHE_SIZE. The cache is shared
+        by every backend in the process for the same server.
+
+        Args:
+            key (tuple): The search's cache key.
+            ids (list): The ids the search returned, best first.
+        """
+        if not self.search_cache_ttl:
+            return
+        with _search_caches_lock:
+            search_cache = _search_caches.setdefault(self.server_key, OrderedDict())
+            search_cache[key] = (time.monotonic(), ids)
+            search_cache.move_to_end(key)
+            while len(search_cache) > self.search_cache_size:
+                search_cache.popitem(last=False)
+
+    def clear_search_cache(self):
+        """Forget every cached search, e.g. after the indexes have changed."""
+        with _search_caches_lock:
+            _search_caches.pop(self.server_key, None)
+
+    def _update_count_key(self, label):
+        return f"wagtail_meilisearch:updates:{label}"
+
+    def record_update(self, label):
+        """
+        Count an object saved or deleted outside of `update_index`, so the delta
+        strategy can tell how far an index has drifted since its last rebuild.
+        Nothing is counted for the other strategies, which don't use the count.
+
+        Args:
+            label (str): The label of the index that was updated.
+        """
+        if self.update_strategy != "delta":
+            return
+        key = self._update_count_key(label)
+        cache.add(key, 0, None)
+        with contextlib.suppress(ValueError):
+            cache.incr(key)
+
+    def get_update_count(self, label):
+        """
+        Get the number of updates made to an index since it was last rebuilt.
+
+        Args:
+            label (str): The label of the index.
+
+        Returns:
+            int: The number of updates.
+        """
+        return cache.get(self._update_count_key(label), 0)
+
+    def reset_update_count(self, label):
+        """
+        Forget the updates made to an index, once it's been rebuilt.
+
+        Args:
+            label (str): The label of the index.
+        """
+        cache.delete(self._update_count_key(label))
+
     def get_index_for_model(self, model):
         """
         Get the MeiliSearch index for a given model.
 
+        Index objects are kept in `index_registry`, keyed by index label, so each
+        one is only set up once per backend.
+
         Args:
             model: The model to get the index for.
 
         Returns:
             MeiliSearchModelIndex: The index for the given model.
         """
-        model_index = MeiliSearchModelIndex(self, model)
+        label = get_index_label(model)
+        model_index = self.index_registry.get(label)
+        if model_index is None:
+            model_index = self.index_registry[label] = MeiliSearchModelIndex(self, model)
         return model_index
 
     def get_rebuilder(self):
@@ -123,6 +292,10 @@ class MeiliSearchBackend(BaseSearchBackend):
         for model in get_indexed_models():
             index = self.get_index_for_model(model)
             index._rebuild()
+            # Deleting the index lost its settings, so put them back
+            index.apply_settings(force=True)
+        self.clear_active_indexes()
+        self.clear_search_cache()
 
     def add_type(self, model):
         """
@@ -132,15 +305,19 @@ class MeiliSearchBackend(BaseSearchBackend):
             model: The model to add to the index.
         """
         self.get_index_for_model(model).add_model(model)
+        self.clear_active_indexes()
 
     def refresh_index(self):
         """Refresh all indexes for indexed models."""
-        refreshed_indexes = []
+        self.clear_active_indexes()
+        self.clear_search_cache()
+        refreshed_names = set()
         for model in get_indexed_models():
             index = self.get_index_for_model(model)
-            if index not in refreshed_indexes:
-                index.refresh()
-                refreshed_indexes.append(index)
+            if index.name in refreshed_names:
+                continue
+            index.refresh()
+            refreshed_names.add(index.name)
 
     def add(self, obj):
         """
@@ -149,7 +326,11 @@ class MeiliSearchBackend(BaseSearchBackend):
         Args:
             obj: The object to add to the index.
         """
-        self.get_index_for_model(type(obj)).add_item(obj)
+        index = self.get_index_for_model(type(obj))
+        index.add_item(obj)
+        self.clear_active_indexes(index.label)
+        self.clear_search_cache()
+        self.record_update(index.label)
 
     def add_bulk(self, model, obj_list):
         """
@@ -161,6 +342,8 @@ class MeiliSearchBackend(BaseSearchBackend):
         """
         index = self.get_index_for_model(model)
         index.add_items(model, obj_list)
+        self.clear_active_indexes(index.label)
+        self.clear_search_cache()
 
     def delete(self, obj):
         """
@@ -169,7 +352,10 @@ class MeiliSearchBackend(BaseSearchBackend):
         Args:
             obj: The object to delete from the index.
         """
-        self.get_index_for_model(type(obj)).delete_item(obj)
+        index = self.get_index_for_model(type(obj))
+        index.delete_item(obj)
+        self.clear_search_cache()
+        self.record_update(index.label)
 
     def _search(self, query_compiler_class, query, model_or_queryset, **kwargs):
         """
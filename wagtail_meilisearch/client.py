@@ -0,0 +1,112 @@
+import threading
+
+import meilisearch
+import requests
+from meilisearch._httprequests import HttpRequests
+from requests.adapters import HTTPAdapter
+
+# Wagtail creates a new search backend for every search, and for every object
+# saved or deleted, so clients are kept here rather than on the backend, one per
+# server and key, for their connections to outlive a single request.
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+# HttpRequests is private to meilisearch-python, see the note on the pin in
+# pyproject.toml.
+class SessionHttpRequests(HttpRequests):
+    """
+    The MeiliSearch client's HttpRequests, sending everything through a shared
+    requests.Session so connections are kept alive and reused, rather than
+    opening a new one for every request.
+    """
+
+    def __init__(self, config, session):
+        """
+        Initialize the SessionHttpRequests.
+
+        Args:
+            config (meilisearch.config.Config): The client's config.
+            session (requests.Session): The session to send requests with.
+        """
+        super().__init__(config)
+        self.session = session
+
+    def get(self, path):
+        return self.send_request(self.session.get, path)
+
+    def post(self, path, body=None, content_type="application/json"):
+        return self.send_request(self.session.post, path, body, content_type)
+
+    def patch(self, path, body=None, content_type="application/json"):
+        return self.send_request(self.session.patch, path, body, content_type)
+
+    def put(self, path, body=None, content_type="application/json"):
+        return self.send_request(self.session.put, path, body, content_type)
+
+    def delete(self, path, body=None):
+        return self.send_request(self.session.delete, path, body)
+
+
+class MeiliSearchClient(meilisearch.Client):
+    """
+    A MeiliSearch client that keeps a pool of HTTP connections open for the
+    lifetime of the backend.
+
+    Each index handle still gets its own SessionHttpRequests, as the client
+    sets the Content-Type header on it per request, but they all share the
+    client's session and its connection pool.
+    """
+
+    def __init__(self, url, api_key=None, pool_size=10, **kwargs):
+        """
+        Initialize the MeiliSearchClient.
+
+        Args:
+            url (str): The url of the MeiliSearch server.
+            api_key (str, optional): The MeiliSearch API key.
+            pool_size (int, optional): The number of connections to keep open.
+            **kwargs: Any other arguments for meilisearch.Client.
+        """
+        super().__init__(url, api_key, **kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.http = SessionHttpRequests(self.config, self.session)
+
+    def index(self, uid):
+        """
+        Get a handle on an index, without making a request.
+
+        Args:
+            uid (str): The uid of the index.
+
+        Returns:
+            meilisearch.index.Index: The index, sending its requests through the
+                client's session.
+        """
+        index = super().index(uid)
+        index.http = SessionHttpRequests(self.config, self.session)
+        return index
+
+
+def get_client(url, api_key=None, pool_size=10):
+    """
+    Get the shared MeiliSearchClient for a server, creating it the first time.
+
+    Args:
+        url (str): The url of the MeiliSearch server.
+        api_key (str, optional): The MeiliSearch API key.
+        pool_size (int, optional): The number of connections to keep open, only
+            used when the client is first created.
+
+    Returns:
+        MeiliSearchClient: The client.
+    """
+    key = (url, api_key)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = MeiliSearchClient(url, api_key, pool_size=pool_size)
+    return client
@@ -1,12 +1,23 @@
 import contextlib
 import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from itertools import islice
 
-from requests.exceptions import HTTPError
 import arrow
+from django.conf import settings
+from django.db.models import Q, QuerySet, prefetch_related_objects
+from django.utils import timezone
 from django.utils.functional import cached_property
-from meilisearch.index import Index
+from meilisearch.errors import (
+    MeilisearchApiError,
+    MeilisearchCommunicationError,
+    MeilisearchTimeoutError,
+)
 
-from .utils import get_document_fields, get_index_label, weak_lru
+from .utils import get_document_fields, get_related_field_names, to_ndjson
 
 try:
     from cacheops import invalidate_model
@@ -23,17 +34,19 @@ class MeiliIndexError(Exception):
 class MeiliSearchModelIndex:
     """Creates a working index for each model sent to it."""
 
-    def __init__(self, backend, model):
+    def __init__(self, backend, model, label=None):
         """
         Initialize the MeiliSearchModelIndex.
 
         Args:
             backend (MeiliSearchBackend): The backend instance.
             model (Model): The Django model to be indexed.
+            label (str, optional): Use this index uid instead of the model's own,
+                e.g. for an index that's being rebuilt.
         """
         self.backend = backend
-        self.client = backend.client
         self.model = model
+        self.label = label
         self.model_fields = set(_.name for _ in model._meta.fields)
         self.name = model._meta.label
         self.index = self._set_index(model)
@@ -45,38 +58,87 @@ class MeiliSearchModelIndex:
             "first_published_at",
             "last_published_at",
         ]
-        self._update_paginator(self.label)
+        # Set by the rebuilder, so batches carry on sending between add_items
+        # calls until it finishes.
+        self.send_in_background = False
+        self._executor = None
+        self._pending = deque()
+        # The number of batches that couldn't be sent, so a rebuild can tell
+        # whether it has every document.
+        self.failed_batches = 0
 
-    def _update_paginator(self, label):
-        try:
-            self.client.index(label).update_settings(
-                {
-                    "pagination": {
-                        "maxTotalHits": self.backend.query_limit,
-                    },
-                },
-            )
-        except Exception as err:
-            sys.stdout.write(f"WARN: Failed to update paginator on {label}\n")
-            sys.stdout.write(f"{err}\n")
+    @property
+    def client(self):
+        """
+        The backend's MeiliSearch client, resolved at the point of use.
+
+        Returns:
+            meilisearch.Client: The backend's client.
+        """
+        return self.backend.client
+
+    def apply_settings(self, force=False):
+        """
+        Push the backend's index settings to MeiliSearch.
 
-    def _update_stop_words(self, label):
+        This is a request to MeiliSearch, so it's only done when an index is
+        being (re)built rather than whenever an index object is created, which
+        keeps it out of the saves and deletes made by web requests.
+
+        Args:
+            force (bool, optional): Send every setting, without checking the
+                index's current ones first. Needed straight after the index has
+                been deleted, as the deletion may not have been processed yet.
+        """
+        self._update_settings(self.label, force=force)
+
+    def _get_settings(self):
+        """
+        Get the settings the backend wants on its indexes.
+
+        Returns:
+            dict: The settings, as MeiliSearch names them.
         """
-        Update the stop words for the given index.
+        return {
+            "pagination": {
+                "maxTotalHits": self.backend.query_limit,
+            },
+            "stopWords": self.backend.stop_words,
+        }
+
+    def _update_settings(self, label, force=False):
+        """
+        Update the settings for the given index, in a single request.
+
+        Settings updates are queued as tasks like any other, and a change of
+        stop words has MeiliSearch reindex every document, so only the settings
+        that differ from the index's current ones are sent. An index that
+        doesn't exist yet can't be read, and just gets all of them.
 
         Args:
             label (str): The label of the index to update.
+            force (bool, optional): Send every setting, whatever the index has.
         """
+        index = self.client.index(label)
+        index_settings = self._get_settings()
+        if not force:
+            with contextlib.suppress(Exception):
+                current = index.get_settings()
+                # MeiliSearch keeps stop words as a set, and returns them sorted
+                index_settings = {
+                    key: value
+                    for key, value in index_settings.items()
+                    if current.get(key) != (sorted(set(value)) if key == "stopWords" else value)
+                }
+        if not index_settings:
+            return
+
         try:
-            self.client.index(label).update_settings(
-                {
-                    "stopWords": self.backend.stop_words,
-                },
-            )
-        except Exception:
-            sys.stdout.write(f"WARN: Failed to update stop words on {label}\n")
+            index.update_settings(index_settings)
+        except Exception as err:
+            sys.stdout.write(f"WARN: Failed to update settings on {label}\n")
+            sys.stdout.write(f"{err}\n")
 
-    # @weak_lru()
     def _get_index_settings(self, label):
         """
         Get the settings for the index.
@@ -106,17 +168,10 @@ class MeiliSearchModelIndex:
         if hasattr(self, 'index') and self.index:
             return self.index
 
-        label = self._get_label(model)
-        # if index doesn't exist, create
-        try:
-            index = self.client.index(label)
-        except HTTPError:
-            task = Index.create(self.client.http.config, label, {'primaryKey': 'id'})
-            index = self.client.index(label)
-
-        self.index = index
-
-        return index
+        # client.index() doesn't make a request, MeiliSearch creates the index
+        # itself when the first documents are added to it.
+        self.index = self.client.index(self._get_label(model))
+        return self.index
 
     def _get_label(self, model):
         if hasattr(self, 'label') and self.label:
@@ -176,7 +231,7 @@ class MeiliSearchModelIndex:
         Returns:
             dict: The document to be indexed.
         """
-        doc_fields = dict(self._get_document_fields(model, item))
+        doc_fields = self._get_document_fields(model, item)
         doc_fields.update(id=item.id)
         return doc_fields
 
@@ -198,9 +253,9 @@ class MeiliSearchModelIndex:
 
         doc = self._create_document(self.model, item)
         if self.update_strategy == "soft":
-            self.index.update_documents([doc])
+            self.index.update_documents_ndjson(to_ndjson([doc]))
         else:
-            self.index.add_documents([doc])
+            self.index.add_documents_ndjson(to_ndjson([doc]))
 
     def add_items(self, item_model, items):
         """
@@ -208,7 +263,7 @@ class MeiliSearchModelIndex:
 
         Args:
             item_model (Model): The Django model of the items.
-            items (list): The items to be added to the index.
+            items (iterable): The items to be added to the index.
 
         Returns:
             bool: True if the operation was successful.
@@ -217,20 +272,171 @@ class MeiliSearchModelIndex:
             with contextlib.suppress(Exception):
                 invalidate_model(item_model)
 
-        chunks = [items[x : x + 100] for x in range(0, len(items), 100)]
-
-        for chunk in chunks:
-            if self.update_strategy == "delta":
-                chunk = self._check_deltas(chunk)
-            prepared = [self._create_document(self.model, item) for item in chunk]
-            with contextlib.suppress(Exception):
-                if prepared:
-                    if self.update_strategy in ["soft", "delta"]:
-                        self.index.update_documents(prepared)
-                    else:
-                        self.index.add_documents(prepared)
+        # Documents are prepared here, on the calling thread, as that's where the
+        # ORM work happens. Only the HTTP requests are handed to the workers, and
+        # no more than two batches per worker are left waiting, so preparing
+        # documents can't get too far ahead of sending them. During a rebuild the
+        # workers carry on between calls, so the requests for one chunk overlap
+        # with the database work for the next.
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.backend.bulk_workers)
+        for payload in self._iter_batches(items):
+            self._pending.append(self._executor.submit(self._post_documents, payload))
+            while len(self._pending) > self.backend.bulk_workers * 2:
+                self._wait_for_batch(self._pending.popleft())
+
+        if not self.send_in_background:
+            self.flush()
         return True
 
+    def flush(self):
+        """
+        Wait for every batch handed to the workers to be sent, then shut the
+        workers down.
+        """
+        while self._pending:
+            self._wait_for_batch(self._pending.popleft())
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _iter_batches(self, items):
+        """
+        Prepare documents for the items and group them into NDJSON batches.
+
+        Items are taken BULK_CHUNK_SIZE at a time, so they can come from any
+        iterable, e.g. `queryset.iterator()`, without all being held in memory.
+        A batch is sent early rather than go over BULK_MAX_CHUNK_BYTES, so models
+        with large documents don't end up with huge requests.
+
+        Args:
+            items (iterable): The items to be added to the index.
+
+        Yields:
+            bytes: The NDJSON payload for each batch.
+        """
+        chunk_size = self.backend.bulk_chunk_size
+        max_chunk_bytes = self.backend.bulk_max_chunk_bytes
+        related_field_names = get_related_field_names(self.model)
+        check_deltas = self.update_strategy == "delta"
+        if check_deltas:
+            since = self._get_delta_since()
+            if isinstance(items, QuerySet) and self._has_date_fields:
+                # Leave the filtering to the database, rather than loading every
+                # object only to throw most of them away.
+                items = self.filter_deltas(items, since)
+                check_deltas = False
+
+        items = iter(items)
+        while True:
+            chunk = list(islice(items, chunk_size))
+            if not chunk:
+                break
+
+            if check_deltas:
+                chunk = self._check_deltas(chunk, since)
+
+            # Fetch related objects for the whole chunk up front, rather than once
+            # per item. This is a no-op for anything that's already been prefetched.
+            for field_name in related_field_names:
+                with contextlib.suppress(Exception):
+                    prefetch_related_objects(chunk, field_name)
+
+            batch = []
+            batch_bytes = 0
+            for item in chunk:
+                document = self._create_document(self.model, item)
+                # Nothing but the id means every field failed to resolve, and
+                # there'd be nothing in the document to search on.
+                if len(document) <= 1:
+                    continue
+                line = to_ndjson([document])
+                # Send what we have before this document would take the batch
+                # over the limit. A document that's over the limit by itself
+                # still has to be sent, so it goes on its own.
+                if batch and batch_bytes + len(line) > max_chunk_bytes:
+                    yield b"\n".join(batch)
+                    batch = []
+                    batch_bytes = 0
+                batch.append(line)
+                batch_bytes += len(line) + 1
+
+            if batch:
+                yield b"\n".join(batch)
+
+    def _wait_for_batch(self, future):
+        """
+        Wait for a batch of documents to be sent, warning and counting it if it
+        failed.
+
+        Args:
+            future (Future): The batch's future from the worker pool.
+        """
+        try:
+            future.result()
+        except Exception as err:
+            self.failed_batches += 1
+            sys.stdout.write(f"WARN: Failed to add documents to {self.label}\n")
+            sys.stdout.write(f"{err}\n")
+
+    def _post_documents(self, payload):
+        """
+        Send a batch of documents to the index as NDJSON.
+
+        The documents are already serialised, so the client doesn't have to run
+        them through `json.dumps` again. A batch that fails with a connection
+        problem, a timeout or a server error is retried up to BULK_RETRIES times,
+        waiting a little longer each time, rather than being dropped.
+
+        Args:
+            payload (bytes): The batch's documents as NDJSON.
+
+        Returns:
+            TaskInfo: The MeiliSearch task for the batch.
+        """
+        retries = self.backend.bulk_retries
+        for attempt in range(retries + 1):
+            try:
+                return self._send_documents(payload)
+            except (MeilisearchCommunicationError, MeilisearchTimeoutError) as err:
+                if attempt == retries:
+                    raise
+                error = err
+            except MeilisearchApiError as err:
+                # Anything but a server error or rate limiting is down to the
+                # documents themselves, and will fail the same way again.
+                if attempt == retries or (err.status_code < 500 and err.status_code != 429):
+                    raise
+                error = err
+            sys.stdout.write(
+                f"WARN: Failed to add documents to {self.label}, retrying: {error}\n"
+            )
+            time.sleep(self.backend.bulk_retry_delay * 2**attempt)
+
+    def _send_documents(self, payload):
+        """
+        Make the request adding a batch of documents to the index.
+
+        Args:
+            payload (bytes): The batch's documents as NDJSON.
+
+        Returns:
+            TaskInfo: The MeiliSearch task for the batch.
+        """
+        if self.update_strategy in ["soft", "delta"]:
+            return self.index.update_documents_ndjson(payload)
+        return self.index.add_documents_ndjson(payload)
+
+    @cached_property
+    def _date_fields(self):
+        """
+        The delta fields the model actually has.
+
+        Returns:
+            list: The names of the model's delta fields.
+        """
+        return [field for field in self.delta_fields if field in self.model_fields]
+
     @cached_property
     def _has_date_fields(self):
         """
@@ -239,31 +445,81 @@ class MeiliSearchModelIndex:
         Returns:
             bool: True if the model has any of the delta fields, False otherwise.
         """
-        return bool(self.model_fields.intersection(self.delta_fields))
+        return bool(self._date_fields)
+
+    def _get_delta_since(self):
+        """
+        Get the cutoff for the delta update strategy.
+
+        Returns:
+            datetime: Objects updated after this are included in a delta update.
+        """
+        return arrow.now().shift(**self.update_delta).datetime
 
-    def _check_deltas(self, objects):
+    def filter_deltas(self, queryset, since=None):
+        """
+        Filter a queryset down to the objects a delta update would index.
+
+        This is the database side equivalent of `_check_deltas`, for models that
+        have at least one of the delta fields.
+
+        Args:
+            queryset (QuerySet): The objects to be filtered.
+            since (datetime, optional): The cutoff, worked out from UPDATE_DELTA
+                if it isn't given.
+
+        Returns:
+            QuerySet: The filtered queryset.
+        """
+        if since is None:
+            since = self._get_delta_since()
+        # Without time zone support the database holds naive local times, and
+        # some backends (e.g. SQLite and MySQL) reject an aware cutoff.
+        if not settings.USE_TZ and timezone.is_aware(since):
+            since = timezone.make_naive(since)
+        recent = Q()
+        for field in self._date_fields:
+            recent |= Q(**{f"{field}__gt": since})
+        return queryset.filter(recent)
+
+    def _check_deltas(self, objects, since=None):
         """
         Filter objects based on the delta update strategy.
 
+        Models without any of the delta fields can't be filtered, so all of
+        their objects are kept.
+
         Args:
             objects (list): The objects to be filtered.
+            since (datetime, optional): The cutoff, worked out from UPDATE_DELTA
+                if it isn't given.
 
         Returns:
             list: The filtered list of objects.
         """
+        if not self._has_date_fields:
+            return list(objects)
+
+        date_fields = self._date_fields
         filtered = []
-        since = arrow.now().shift(**self.update_delta).datetime
+        # The cutoff in each form a field's value can take, so that naive
+        # datetimes and plain dates are compared rather than skipped.
+        if since is None:
+            since = self._get_delta_since()
+        since_naive = since.replace(tzinfo=None)
+        since_date = since.date()
         for obj in objects:
-            if self._has_date_fields:
-                for field in self.delta_fields:
-                    if hasattr(obj, field):
-                        val = getattr(obj, field)
-                        try:
-                            if val and val > since:
-                                filtered.append(obj)
-                                break
-                        except TypeError:
-                            pass
+            for field in date_fields:
+                val = getattr(obj, field, None)
+                if isinstance(val, datetime):
+                    recent = val > (since_naive if val.tzinfo is None else since)
+                elif isinstance(val, date):
+                    recent = val > since_date
+                else:
+                    continue
+                if recent:
+                    filtered.append(obj)
+                    break
         return filtered
 
     def delete_item(self, obj):
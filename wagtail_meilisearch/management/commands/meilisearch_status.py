@@ -29,6 +29,7 @@ class Command(BaseCommand):
         # Named (optional) arguments
         parser.add_argument(
             '--indexing',
+            action='store_true',
             help='Show only models that MeiliSearch is currently indexing'
         )
         parser.add_argument(
@@ -37,10 +38,10 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
-        models = []
+        models = set()
         models_string = options.get('models', '')
         if models_string:
-            models = models_string.split(',')
+            models = set(models_string.split(','))
         indexing = options.get('indexing', False)
         b = get_search_backend()
         stats = b.client.get_all_stats()
@@ -54,20 +55,11 @@ class Command(BaseCommand):
             print("Indexes:")
             for k, v in indexes.items():
                 model = k.replace('-', '.')
-                is_indexing = v['isIndexing']
-                if len(models):
-                    if model in models:
-                        if indexing:
-                            if is_indexing:
-                                self._print_index_stats(model, v)
-                        else:
-                            self._print_index_stats(model, v)
-                else:
-                    if indexing:
-                        if is_indexing:
-                            self._print_index_stats(model, v)
-                    else:
-                        self._print_index_stats(model, v)
+                if models and model not in models:
+                    continue
+                if indexing and not v['isIndexing']:
+                    continue
+                self._print_index_stats(model, v)
 
         print("*" * 80)
 
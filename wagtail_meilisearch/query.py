@@ -52,7 +52,7 @@ class MeiliSearchQueryCompiler(BaseSearchQueryCompiler):
         if connector == "AND":
             q = Q(*filters)
         elif connector == "OR":
-            q = OR([Q(fil) for fil in filters])
+            q = OR(filters)
         else:
             return None
 
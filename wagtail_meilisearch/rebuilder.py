@@ -1,6 +1,8 @@
 import sys
 
-from .index import DummyModelIndex
+from meilisearch.errors import MeilisearchApiError
+
+from .index import DummyModelIndex, MeiliSearchModelIndex
 from .utils import get_index_label
 
 
@@ -8,6 +10,9 @@ class MeiliSearchRebuilder:
     def __init__(self, model_index):
         self.index = model_index
         self.uid = get_index_label(self.index.model)
+        self.rebuild_uid = f"{self.uid}__rebuild"
+        self.rebuild_index = None
+        self.active_index = None
         self.dummy_index = DummyModelIndex()
 
     def start(self):
@@ -15,9 +20,13 @@ class MeiliSearchRebuilder:
         Starts the rebuild process for the search index.
 
         This method implements three strategies for rebuilding the index:
-        - 'hard': Deletes every document in the index and adds them anew.
+        - 'hard': Builds a fresh copy of the index under a temporary uid, which
+          `finish` then swaps in for the live one, so search keeps working
+          throughout the rebuild.
         - 'soft': Performs an "add or update" for each document.
-        - 'delta': Only updates documents that have been saved in the last X amount of time.
+        - 'delta': Only updates documents that have been saved in the last X amount of time,
+          unless more than DELTA_REBUILD_RATIO of the index has been updated since it
+          was last rebuilt, in which case just this index gets a 'hard' rebuild.
 
         Returns:
             The appropriate index object for further operations.
@@ -28,18 +37,116 @@ class MeiliSearchRebuilder:
             return self.dummy_index
 
         strategy = self.index.backend.update_strategy
+        self.index.backend.clear_active_indexes()
+
+        if strategy == 'delta' and self._delta_needs_rebuild():
+            return self._start_rebuild_index()
 
         if strategy == 'soft' or strategy == 'delta':
             # Soft update strategy
             index = self.index.backend.get_index_for_model(model)
-        else:
-            # Hard update strategy
-            old_index = self.index.backend.get_index_for_model(model)
-            old_index.delete_all_documents()
+            index.apply_settings()
+            return self._start_sending(index)
 
-        model = self.index.model
-        index = self.index.backend.get_index_for_model(model)
+        # Hard update strategy
+        return self._start_rebuild_index()
+
+    def _delta_needs_rebuild(self):
+        """
+        Work out whether enough of the index has changed since it was last rebuilt
+        that a delta update is no longer good enough.
+
+        Returns:
+            bool: True if the index should be rebuilt from scratch.
+        """
+        backend = self.index.backend
+        updates = backend.get_update_count(self.uid)
+        if not updates:
+            return False
+
+        try:
+            stats = backend.client.index(self.uid).get_stats()
+        except Exception:
+            # No index yet, the delta update will create it
+            return False
+
+        return updates > stats.number_of_documents * backend.delta_rebuild_ratio
+
+    def _start_rebuild_index(self):
+        """
+        Create an empty index under the temporary rebuild uid, clearing out any
+        leftovers from a previous rebuild that didn't finish.
+
+        Returns:
+            MeiliSearchModelIndex: The index to add the rebuilt documents to.
+        """
+        client = self.index.backend.client
+        client.delete_index(self.rebuild_uid)
+        client.create_index(self.rebuild_uid, {"primaryKey": "id"})
+        self.rebuild_index = MeiliSearchModelIndex(
+            self.index.backend, self.index.model, label=self.rebuild_uid
+        )
+        # A rebuild always adds every document, whatever the backend's strategy
+        self.rebuild_index.update_strategy = 'hard'
+        # The index was only just recreated, so don't trust what it reports
+        self.rebuild_index.apply_settings(force=True)
+        return self._start_sending(self.rebuild_index)
+
+    def _start_sending(self, index):
+        """
+        Have the index keep its batches sending in the background between
+        add_items calls, until `finish` waits for them.
+
+        Args:
+            index (MeiliSearchModelIndex): The index the documents are added to.
+
+        Returns:
+            MeiliSearchModelIndex: The index.
+        """
+        index.send_in_background = True
+        index.failed_batches = 0
+        self.active_index = index
         return index
 
     def finish(self):
-        pass
+        """
+        Swap a freshly built index in for the live one and drop the old copy.
+
+        MeiliSearch processes tasks in the order they're enqueued, so the swap
+        happens after every document for the rebuild has been added. If any
+        batch of documents couldn't be sent, the rebuilt index is missing them,
+        so it's dropped and the live index is left as it was.
+        """
+        if self.active_index is not None:
+            # Wait for the last of the documents to be sent
+            self.active_index.flush()
+            self.active_index.send_in_background = False
+            self.active_index = None
+
+        if self.rebuild_index is None:
+            return
+
+        client = self.index.backend.client
+        failed_batches = self.rebuild_index.failed_batches
+        if failed_batches:
+            sys.stdout.write(
+                f"ERROR: {failed_batches} batch(es) of documents failed to send while "
+                f"rebuilding {self.uid}, keeping the current index\n"
+            )
+            client.delete_index(self.rebuild_uid)
+            self.rebuild_index = None
+            return
+
+        # Swapping needs both indexes to exist, so create the live one if this
+        # is its first build.
+        try:
+            client.get_index(self.uid)
+        except MeilisearchApiError as err:
+            if err.status_code != 404:
+                raise
+            client.create_index(self.uid, {"primaryKey": "id"})
+        client.swap_indexes([{"indexes": [self.uid, self.rebuild_uid]}])
+        client.delete_index(self.rebuild_uid)
+        self.rebuild_index = None
+        self.index.backend.reset_update_count(self.uid)
+        self.index.backend.clear_active_indexes()
@@ -1,9 +1,16 @@
+import heapq
 from operator import itemgetter
-from django.db.models import Case, When
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from django.utils.functional import cached_property
+from meilisearch.errors import MeilisearchApiError
 from wagtail.search.backends.base import BaseSearchResults
 from wagtail.search.query import Fuzzy, Phrase, PlainText
 
-from .utils import get_descendant_models, get_index_label, weak_lru
+from .utils import get_field_boosts, get_index_label, get_searchable_models
+
+# The servers, by backend server key, found to be too old for ranking scores
+_servers_without_ranking_score = set()
 
 
 class MeiliSearchResults(BaseSearchResults):
@@ -16,10 +23,27 @@ class MeiliSearchResults(BaseSearchResults):
     _last_count = None
     supports_facet = False
 
-    @weak_lru()
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The ids from MeiliSearch, shared with every slice of these results
+        self._shared_ids = {}
+
+    def _clone(self):
+        """
+        Copy the results, e.g. for a slice, sharing the ids from MeiliSearch so
+        that counting the results and getting a page of them only search once.
+
+        Returns:
+            MeiliSearchResults: The copy.
+        """
+        new = super()._clone()
+        new._shared_ids = self._shared_ids
+        return new
+
     def _get_field_boosts(self, model):
         """
-        Get the boost values for fields in a given model.
+        Get the boost values for fields in a given model. These are worked out
+        once per model class, rather than on every search.
 
         Args:
             model: The model to get field boosts for.
@@ -27,21 +51,18 @@ class MeiliSearchResults(BaseSearchResults):
         Returns:
             dict: A dictionary mapping field names to their boost values.
         """
-        boosts = {}
-        for field in model.search_fields:
-            if hasattr(field, "boost"):
-                boosts[field.field_name] = field.boost
-        return boosts
+        return get_field_boosts(model)
 
-    @property
+    @cached_property
     def models(self):
         """
-        Get all descendant models of the queried model.
+        Get the descendant models of the queried model that have search fields,
+        and so indexes worth searching.
 
         Returns:
-            list: A list of descendant models.
+            tuple: The descendant models.
         """
-        return get_descendant_models(self.query_compiler.queryset.model)
+        return get_searchable_models(self.query_compiler.queryset.model)
 
     @property
     def query_string(self):
@@ -64,77 +85,276 @@ class MeiliSearchResults(BaseSearchResults):
         calculates scores, and returns the results in the order specified by the query compiler.
 
         Returns:
-            QuerySet: A queryset of search results, ordered by relevance if specified.
+            QuerySet or list: The search results, ordered by relevance if specified.
+        """
+        qc = self.query_compiler
+        sorted_ids = self._get_sorted_ids()
+
+        # Retrieve only the current window of results from the database
+        window_sorted_ids = sorted_ids[self.start : self.stop]
+        results = qc.queryset.filter(pk__in=window_sorted_ids)
+
+        # Any select_related on the searched queryset carries through the filter
+        # above, prefetches requested on the results need adding explicitly.
+        if self.prefetch_related:
+            results = results.prefetch_related(*self.prefetch_related)
+
+        # The ids are unique, so only joins from filters on the searched
+        # queryset (e.g. across a many-to-many) could repeat a row.
+        if len(results.query.alias_map) > 1:
+            results = results.distinct()
+
+        # Preserve the order by score
+        if qc.order_by_relevance:
+            results = self._order_by_ids(results, window_sorted_ids)
+
+        return results
+
+    def _get_sorted_ids(self):
+        """
+        Get the ids of the matching objects from MeiliSearch, best first.
+
+        With the backend's short lived search cache turned on, the ids are kept
+        there, so paging through the same search doesn't go back to MeiliSearch
+        for every page.
+        The database filtering and ordering still happens on each request.
+
+        Returns:
+            list: The ids of the hits, with duplicates removed.
         """
         models = self.models
         terms = self.query_string
+        qc = self.query_compiler
 
-        models_boosts = {}
-        for model in models:
-            label = get_index_label(model)
-            models_boosts[label] = self._get_field_boosts(model)
+        models_boosts = {
+            get_index_label(model): self._get_field_boosts(model) for model in models
+        }
+        use_ranking_score = self._use_ranking_score(models_boosts)
+        use_cache = bool(self.backend.search_cache_ttl)
+        limit = self._get_limit(use_ranking_score, use_cache)
 
-        # Get active indexes
-        # For model types that don't have any documents, meilisearch won't
-        # create an index, so we have to check before running multi_search
-        # if an index exists, otherwise the entire multi_search call will fail.
-        limit = self.backend.query_limit
-        active_index_dict = self.backend.client.get_indexes({"limit": limit})
-        active_indexes = [index.uid for index in active_index_dict["results"]]
-
-        queries = [
-            {
-                "indexUid": index_uid,
-                "q": terms,
-                **self.backend.search_params,
-            }
-            for index_uid in models_boosts
-            if index_uid in active_indexes
-        ]
-
-        # Execute multi-search
-        multi_search_results = self.backend.client.multi_search(queries)
-
-        # Process and enhance results
+        cache_key = (
+            terms,
+            tuple(get_index_label(model) for model in models),
+            qc.order_by_relevance,
+            limit,
+        )
+        # Another slice of these results may already have the ids, either for at
+        # least as many hits, or for every hit there is.
+        shared = self._shared_ids.get("sorted_ids")
+        if shared is not None and (shared[0] >= limit or len(shared[1]) < shared[0]):
+            return shared[1]
+
+        if use_cache:
+            sorted_ids = self.backend.get_cached_search(cache_key)
+            if sorted_ids is not None:
+                self._shared_ids["sorted_ids"] = (limit, sorted_ids)
+                return sorted_ids
+
+        try:
+            multi_search_results = self._multi_search(models_boosts, limit, use_ranking_score)
+        except MeilisearchApiError as err:
+            if not use_ranking_score or not self._is_ranking_score_error(err):
+                raise
+            _servers_without_ranking_score.add(self.backend.server_key)
+            use_ranking_score = False
+            limit = self._get_limit(use_ranking_score, use_cache)
+            cache_key = cache_key[:-1] + (limit,)
+            multi_search_results = self._multi_search(models_boosts, limit, use_ranking_score)
+
+        # Merge the hits, scoring each one on the way through when we need to
+        # order by relevance.
         results = []
         for index_results in multi_search_results["results"]:
-            index_uid = index_results["indexUid"]
-            boost_value = models_boosts[index_uid]
+            boosts = models_boosts[index_results["indexUid"]]
 
             for hit in index_results["hits"]:
-                hit_b = {
-                    **hit,
-                    "boosts": boost_value,
-                }
-                results.append(hit_b)
+                if use_ranking_score:
+                    hit["score"] = hit["_rankingScore"]
+                elif qc.order_by_relevance:
+                    # Score on the total length of matched text, weighted by the
+                    # field's boost.
+                    hit["score"] = sum(
+                        sum(match["length"] for match in matches) * boosts.get(key, 1)
+                        for key, matches in hit["_matchesPosition"].items()
+                    )
+                results.append(hit)
 
-        # Calculate scores
-        for item in results:
-            score = sum(
-                len(str(matches)) * (item["boosts"].get(key, 1) or 1)
-                for key, matches in item["_matchesPosition"].items()
-            )
-            item["score"] = score
+        # With multi-table inheritance the same object is indexed once per model
+        # (e.g. in both the Page index and its specific page type's index), so
+        # keep only one hit for each id. Nothing past `limit` can be in the
+        # window, so stop there.
+        if qc.order_by_relevance:
+            # Keep the best scored hit for each id, then pick out the top ones
+            # rather than sorting every hit.
+            best_hits = {}
+            for hit in results:
+                current = best_hits.get(hit["id"])
+                if current is None or hit["score"] > current["score"]:
+                    best_hits[hit["id"]] = hit
+            top_hits = heapq.nlargest(limit, best_hits.values(), key=itemgetter("score"))
+            sorted_ids = [hit["id"] for hit in top_hits]
+        else:
+            # The database orders these by the queryset's own ordering
+            seen_ids = set()
+            sorted_ids = []
+            for hit in results:
+                if hit["id"] not in seen_ids:
+                    seen_ids.add(hit["id"])
+                    sorted_ids.append(hit["id"])
+                    if len(sorted_ids) == limit:
+                        break
 
-        # Sort results by score
-        sorted_results = sorted(results, key=itemgetter("score"), reverse=True)
-        sorted_ids = [item["id"] for item in sorted_results]
+        self._shared_ids["sorted_ids"] = (limit, sorted_ids)
+        if use_cache:
+            self.backend.cache_search(cache_key, sorted_ids)
+        return sorted_ids
 
-        # Retrieve results from the database
-        qc = self.query_compiler
-        window_sorted_ids = sorted_ids[self.start : self.stop]
-        results = qc.queryset.filter(pk__in=window_sorted_ids)
+    def _use_ranking_score(self, models_boosts):
+        """
+        Check whether the hits can be ordered by MeiliSearch's own ranking score.
 
-        # Preserve the order by score
-        if qc.order_by_relevance:
-            preserved_order = Case(
-                *[When(pk=pk, then=pos) for pos, pk in enumerate(window_sorted_ids)],
+        Field boosts can only be applied by scoring the match positions
+        ourselves. Without any, MeiliSearch's ranking score does the job, and the
+        much bulkier match positions can be left out of the response. Ranking
+        scores need MeiliSearch 1.3, older servers reject the query.
+
+        Args:
+            models_boosts (dict): The field boosts for each searched index.
+
+        Returns:
+            bool: True if the ranking score should be used.
+        """
+        return bool(
+            self.query_compiler.order_by_relevance
+            and self.backend.server_key not in _servers_without_ranking_score
+            and not any(
+                boost != 1 for boosts in models_boosts.values() for boost in boosts.values()
             )
-            results = results.order_by(preserved_order)
+        )
 
-        res = results.distinct()
+    def _is_ranking_score_error(self, err):
+        """
+        Check whether a search was rejected for asking for ranking scores, as
+        servers older than MeiliSearch 1.3 don't know the parameter.
 
-        return res
+        Args:
+            err (MeilisearchApiError): The error from the search.
+
+        Returns:
+            bool: True if the showRankingScore parameter itself was rejected.
+        """
+        if err.status_code != 400:
+            return False
+        if err.code == "invalid_search_show_ranking_score":
+            return True
+        # Older servers reject any unknown parameter as a generic bad request
+        return err.code == "bad_request" and "showRankingScore" in (err.message or "")
+
+    def _get_limit(self, use_ranking_score, use_cache):
+        """
+        Get the most hits to ask each index for.
+
+        When the hits are kept in MeiliSearch's own order, either ranked by its
+        ranking score or left for the database to order, no single index needs
+        to return more than `stop` hits to fill a window ending there. Scoring
+        the match positions ourselves can lift a hit from anywhere in an index's
+        results into the window, so then every hit up to QUERY_LIMIT is needed.
+        With the search cache on, the full list is fetched so that every page of
+        the search can be cut from it.
+
+        Args:
+            use_ranking_score (bool): Whether the hits are ordered by MeiliSearch's
+                ranking score.
+            use_cache (bool): Whether the search cache is on.
+
+        Returns:
+            int: The limit.
+        """
+        limit = self.backend.query_limit
+        meilisearch_order = use_ranking_score or not self.query_compiler.order_by_relevance
+        if self.stop is not None and meilisearch_order and not use_cache:
+            limit = min(self.stop, limit)
+        return limit
+
+    def _multi_search(self, labels, limit, use_ranking_score):
+        """
+        Search every index at once.
+
+        For model types that don't have any documents, MeiliSearch won't create
+        an index, and the entire multi_search call fails if any of its indexes
+        is missing, so only the active indexes are searched. The list of them is
+        cached, so if one has been deleted since, e.g. by another process, the
+        list is looked up again and the search retried once.
+
+        Args:
+            labels (iterable): The labels of the indexes to search.
+            limit (int): The most hits to get from each index.
+            use_ranking_score (bool): Score the hits with MeiliSearch's ranking
+                score, rather than by their match positions.
+
+        Returns:
+            dict: The multi_search response.
+        """
+        order_by_relevance = self.query_compiler.order_by_relevance
+        search_params = dict(
+            self.backend.search_params,
+            limit=limit,
+            showMatchesPosition=order_by_relevance and not use_ranking_score,
+        )
+        if use_ranking_score:
+            search_params["showRankingScore"] = True
+
+        def get_queries():
+            active_indexes = self.backend.get_active_indexes()
+            return [
+                {
+                    "indexUid": label,
+                    "q": self.query_string,
+                    **search_params,
+                }
+                for label in labels
+                if label in active_indexes
+            ]
+
+        try:
+            return self.backend.client.multi_search(get_queries())
+        except MeilisearchApiError as err:
+            if err.code != "index_not_found":
+                raise
+            self.backend.clear_active_indexes()
+            return self.backend.client.multi_search(get_queries())
+
+    def _order_by_ids(self, queryset, ids):
+        """
+        Order a queryset to match a list of primary keys.
+
+        On PostgreSQL with integer keys this is a single array_position() lookup.
+        Elsewhere the objects are fetched and sorted in Python, rather than
+        sending the database a CASE with one WHEN per id.
+
+        Args:
+            queryset: The queryset to order.
+            ids (list): The primary keys, in the order they should come back.
+
+        Returns:
+            QuerySet or list: The ordered results.
+        """
+        opts = queryset.model._meta
+        if connections[queryset.db].vendor == "postgresql" and all(
+            isinstance(pk, int) for pk in ids
+        ):
+            qn = connections[queryset.db].ops.quote_name
+            position = RawSQL(
+                f"array_position(%s::bigint[], {qn(opts.db_table)}.{qn(opts.pk.column)}::bigint)",
+                (list(ids),),
+            )
+            return queryset.annotate(_meili_position=position).order_by("_meili_position")
+
+        # Ids from MeiliSearch may not be the same type as the pk, so compare
+        # them as strings.
+        positions = {str(pk): pos for pos, pk in enumerate(ids)}
+        return sorted(queryset, key=lambda obj: positions.get(str(obj.pk), len(positions)))
 
     def _do_count(self):
         """
@@ -145,12 +365,57 @@ class MeiliSearchResults(BaseSearchResults):
         Returns:
             int: The total number of search results.
         """
-        if self._count_cache:
+        if self._count_cache is not None:
             return self._count_cache
-        if self._results_cache:
+        if self._results_cache is not None:
             return len(self._results_cache)
 
-        res = self._do_search()
-        self._count_cache = res.count()
-        self._results_cache = list(res)
+        count = self._estimate_count()
+        if count is not None:
+            self._count_cache = count
+            return self._count_cache
+
+        self._results_cache = list(self._do_search())
+        self._count_cache = len(self._results_cache)
         return self._count_cache
+
+    def _estimate_count(self):
+        """
+        Get the number of hits straight from MeiliSearch's estimatedTotalHits,
+        without fetching any documents or touching the database.
+
+        This only matches what _do_search would return when a single index is
+        searched (so there are no duplicate hits to merge) and the queryset has no
+        filters of its own for the database to apply. Otherwise None is returned
+        and the count has to come from a full search.
+
+        Returns:
+            int or None: The number of hits in the current window, or None.
+        """
+        if self.query_compiler.queryset.query.has_filters():
+            return None
+
+        active_indexes = self.backend.get_active_indexes()
+        labels = [get_index_label(model) for model in self.models]
+        labels = [label for label in labels if label in active_indexes]
+        if not labels:
+            return 0
+        if len(labels) > 1:
+            return None
+
+        try:
+            result = self.backend.client.index(labels[0]).search(
+                self.query_string,
+                {"limit": 0, "attributesToRetrieve": ["id"]},
+            )
+        except MeilisearchApiError as err:
+            if err.code != "index_not_found":
+                raise
+            # The cached list of active indexes is out of date, so leave the
+            # count to a full search, which looks them up again.
+            self.backend.clear_active_indexes()
+            return None
+        count = min(result["estimatedTotalHits"], self.backend.query_limit) - self.start
+        if self.stop is not None:
+            count = min(count, self.stop - self.start)
+        return max(count, 0)
@@ -1,33 +1,24 @@
-import contextlib
-import functools
-import weakref
+import json
+from collections import defaultdict
 from functools import lru_cache
 
 from django.apps import apps
 from django.db.models import Manager, Model, QuerySet
+from django.db.models.signals import class_prepared
 from wagtail.search.index import AutocompleteField, FilterField, RelatedFields, SearchField
+from wagtail.search.index import class_is_indexed as wagtail_class_is_indexed
+from wagtail.search.index import get_indexed_models as wagtail_get_indexed_models
 
 from .settings import AUTOCOMPLETE_SUFFIX, FILTER_SUFFIX
 
+try:
+    import orjson
 
-def weak_lru(maxsize=128, typed=False):
-    """
-    LRU Cache decorator that keeps a weak reference to "self" and
-    can be safely used on class methods
-    """
-
-    def wrapper(func):
-        @functools.lru_cache(maxsize, typed)
-        def _func(_self, *args, **kwargs):
-            return func(_self(), *args, **kwargs)
+    USING_ORJSON = True
+except ImportError:
+    USING_ORJSON = False
 
-        @functools.wraps(func)
-        def inner(self, *args, **kwargs):
-            return _func(weakref.ref(self), *args, **kwargs)
-
-        return inner
-
-    return wrapper
+DATE_FIELDS = frozenset(["created_at", "updated_at", "first_published_at", "last_published_at"])
 
 
 @lru_cache(maxsize=None)
@@ -50,16 +41,52 @@ def get_field_mapping(field):
     return field.field_name
 
 
+@lru_cache(maxsize=None)
+def get_field_boosts(model):
+    """
+    Returns a dict mapping the model's search fields to their boosts, with fields
+    that don't set one boosted by 1.
+    """
+    boosts = {}
+    for field in model.search_fields:
+        if hasattr(field, "boost"):
+            boosts[field.field_name] = field.boost or 1
+    return boosts
+
+
+@lru_cache(maxsize=None)
+def get_descendants_index():
+    """
+    Returns a dict mapping every class in the installed models' MROs to the models
+    descended from it, built in a single pass over the installed models.
+    """
+    descendants = defaultdict(list)
+    for other_model in apps.get_models():
+        for ancestor in other_model.__mro__:
+            descendants[ancestor].append(other_model)
+    return {ancestor: tuple(models) for ancestor, models in descendants.items()}
+
+
 @lru_cache(maxsize=None)
 def get_descendant_models(model):
     """
     Returns all descendants of a model.
     e.g. for a search on Page, return [HomePage, ContentPage, Page] etc.
     """
-    descendant_models = [
-        other_model for other_model in apps.get_models() if issubclass(other_model, model)
-    ]
-    return descendant_models
+    return get_descendants_index().get(model, ())
+
+
+@lru_cache(maxsize=None)
+def get_searchable_models(model):
+    """
+    Returns the descendants of a model that have any search fields, and so can
+    have documents in an index.
+    """
+    return tuple(
+        other_model
+        for other_model in get_descendant_models(model)
+        if hasattr(other_model, "get_search_fields") and get_resolved_search_fields(other_model)
+    )
 
 
 @lru_cache(maxsize=None)
@@ -67,17 +94,28 @@ def get_indexed_models():
     """
     Returns a list of all models that are registered for indexing.
     """
-    from wagtail.search.index import get_indexed_models as wagtail_get_indexed_models
-
     return wagtail_get_indexed_models()
 
 
+def clear_model_caches(sender, **kwargs):
+    """
+    Clears the lookups built from the app registry when a model class is
+    prepared, so models created after they were first used (e.g. in tests)
+    are picked up.
+    """
+    get_descendants_index.cache_clear()
+    get_descendant_models.cache_clear()
+    get_searchable_models.cache_clear()
+    get_indexed_models.cache_clear()
+
+
+class_prepared.connect(clear_model_caches, dispatch_uid="wagtail_meilisearch_clear_model_caches")
+
+
 def class_is_indexed(model):
     """
     Returns True if the model is registered for indexing.
     """
-    from wagtail.search.index import class_is_indexed as wagtail_class_is_indexed
-
     return wagtail_class_is_indexed(model)
 
 
@@ -85,45 +123,98 @@ def prepare_value(value):
     """
     Prepares a value for indexing.
     """
+    # Plain strings are by far the most common value, so check for them first
+    if type(value) is str:
+        return value
     if not value:
         return ""
     if isinstance(value, str):
         return value
     if isinstance(value, list):
-        return ", ".join(prepare_value(item) for item in value)
+        # Lists of strings are the common case, and need no per item work
+        if all(isinstance(item, str) for item in value):
+            return ", ".join(value)
+        return ", ".join([prepare_value(item) for item in value])
     if isinstance(value, dict):
-        return ", ".join(prepare_value(item) for item in value.values())
+        return ", ".join([prepare_value(item) for item in value.values()])
     if callable(value):
         return str(value())
     return str(value)
 
 
 @lru_cache(maxsize=None)
-def get_document_fields(model, item):
+def get_resolved_search_fields(model):
     """
-    Walks through the model's search fields and returns a dictionary of fields to be indexed.
+    Returns the model's search fields with their mapped document names worked out,
+    as a tuple of (field, name, sub_fields) where sub_fields is a tuple of
+    (sub_field, name) for RelatedFields and None otherwise.
     """
-    doc_fields = {}
+    resolved = []
     for field in model.get_search_fields():
         if isinstance(field, (SearchField, FilterField, AutocompleteField)):
-            with contextlib.suppress(Exception):
-                doc_fields[get_field_mapping(field)] = prepare_value(field.get_value(item))
+            resolved.append((field, get_field_mapping(field), None))
         elif isinstance(field, RelatedFields):
+            # Only one level of related fields is indexed
+            sub_fields = tuple(
+                (sub_field, f"{field.field_name}__{get_field_mapping(sub_field)}")
+                for sub_field in field.fields
+                if not isinstance(sub_field, RelatedFields)
+            )
+            resolved.append((field, field.field_name, sub_fields))
+    return tuple(resolved)
+
+
+@lru_cache(maxsize=None)
+def get_related_field_names(model):
+    """
+    Returns the names of the model's RelatedFields search fields.
+    """
+    return tuple(
+        field.field_name
+        for field in model.get_search_fields()
+        if isinstance(field, RelatedFields)
+    )
+
+
+def get_document_fields(model, item):
+    """
+    Walks through the model's search fields and returns a dictionary of fields to be indexed.
+    """
+    doc_fields = {}
+    # A plain try/except rather than contextlib.suppress, which would create
+    # and enter a context manager for every field of every item.
+    for field, name, sub_fields in get_resolved_search_fields(model):
+        if sub_fields is None:
+            try:
+                doc_fields[name] = prepare_value(field.get_value(item))
+            except Exception:
+                pass
+            continue
+
+        try:
             value = field.get_value(item)
+            related_objects = None
             if isinstance(value, (Manager, QuerySet)):
-                qs = value.all()
-                for sub_field in field.fields:
-                    sub_values = qs.values_list(sub_field.field_name, flat=True)
-                    with contextlib.suppress(Exception):
-                        doc_fields[f"{field.field_name}__{get_field_mapping(sub_field)}"] = (
-                            prepare_value(list(sub_values))
-                        )
-            elif isinstance(value, Model):
-                for sub_field in field.fields:
-                    with contextlib.suppress(Exception):
-                        doc_fields[f"{field.field_name}__{get_field_mapping(sub_field)}"] = (
-                            prepare_value(sub_field.get_value(value))
-                        )
+                # One query for all the sub fields, or none at all if the
+                # relation has been prefetched.
+                related_objects = list(value.all())
+        except Exception:
+            continue
+
+        if related_objects is not None:
+            for sub_field, sub_name in sub_fields:
+                try:
+                    doc_fields[sub_name] = prepare_value(
+                        [sub_field.get_value(obj) for obj in related_objects]
+                    )
+                except Exception:
+                    pass
+        elif isinstance(value, Model):
+            for sub_field, sub_name in sub_fields:
+                try:
+                    doc_fields[sub_name] = prepare_value(sub_field.get_value(value))
+                except Exception:
+                    pass
     return doc_fields
 
 
@@ -132,6 +223,14 @@ def has_date_fields(obj):
     """
     Checks if the object has any of the specified date fields.
     """
-    date_fields = ["created_at", "updated_at", "first_published_at", "last_published_at"]
-    fields = [field.name for field in obj._meta.fields]
-    return any(field in date_fields for field in fields)
+    return not DATE_FIELDS.isdisjoint(field.name for field in obj._meta.fields)
+
+
+def to_ndjson(documents):
+    """
+    Serialises a list of documents to newline delimited JSON bytes, ready to be
+    sent to MeiliSearch as-is. Uses orjson when it's installed.
+    """
+    if USING_ORJSON:
+        return b"\n".join(orjson.dumps(doc) for doc in documents)
+    return "\n".join(json.dumps(doc) for doc in documents).encode("utf-8")